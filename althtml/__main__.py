@@ -1,26 +1,87 @@
 import yaml
-from .watcher import run_watcher
+from .watcher import run_watcher, watch_file
+from .paths import glob_all
 import argparse
-from pathlib import Path
+import os
+import random
+import signal
+import sys
 import time
+from pathlib import Path
+
+try:
+    import orjson as json
+except ImportError:
+    import json
+
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+RETRY_DELAY_MIN = 1.0 # Seconds before the first retry after an error
+RETRY_DELAY_MAX = 30.0 # Cap for the exponential backoff
+RETRY_POLL_INTERVAL = 0.1 # Seconds between checks for a retry request while backing off
+_retry_requested = False # Set by SIGHUP or a config edit to skip the remaining backoff
+
+def request_retry(*_):
+    """Asks the backoff wait to end early. Only assigns a flag, so it is safe to call from a signal handler."""
+    global _retry_requested
+    _retry_requested = True
+
+def wait_for_retry(delay):
+    """Sleeps up to delay seconds in short slices, returning early once a retry is requested."""
+    global _retry_requested
+    deadline = time.monotonic() + delay
+    while not _retry_requested and time.monotonic() < deadline:
+        time.sleep(RETRY_POLL_INTERVAL)
+    _retry_requested = False
+
+def load_config(config_path):
+    """Parses the config file, as JSON if it ends in .json and as YAML otherwise."""
+    with open(config_path, "rb") as f:
+        if str(config_path).endswith('.json'):
+            return json.loads(f.read())
+        return yaml.load(f, Loader=Loader)
+
+def expand_globs(cfg, base_path):
+    """Resolves the header and watch patterns into (no_write_paths, watch_paths)."""
+    no_write_paths = glob_all(base_path, cfg.get('headers', ()))
+    watch_paths = glob_all(base_path, cfg.get('watch', ()))
+    return no_write_paths, watch_paths
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
                         prog='ProgramName',
                         description='What the program does',
                         epilog='Text at the bottom of help')
-    parser.add_argument('config')
+    parser.add_argument('config', help='YAML config file; a .json file with the same keys is also accepted')
     args = parser.parse_args()
-    cfg = yaml.safe_load(open(args.config, "r"))
+    cfg = load_config(args.config)
+    cfg_mtime = os.stat(args.config).st_mtime
     base_path = Path('.')
+    write_pairs = None # Recomputed only when cfg changes
+    # Without a terminal SIGHUP means 'retry now'; in a terminal it keeps its default action, so closing it stops the watcher
+    if hasattr(signal, 'SIGHUP') and not (sys.stdin is not None and sys.stdin.isatty()):
+        signal.signal(signal.SIGHUP, request_retry)
+    try:
+        watch_file(args.config, request_retry)
+    except OSError as e:
+        print(f"Warning: Cannot watch config for changes ({e}), retrying on a timer only.")
+    delay = RETRY_DELAY_MIN
     while True:
         try:
-            no_write_paths = {header for header_str in cfg['headers'] for header in base_path.glob(header_str)} if 'headers' in cfg else set()
-            watch_paths = {watch_path for watch_path_str in cfg['watch'] for watch_path in base_path.glob(watch_path_str)} if 'watch' in cfg else set()
-            write_pairs = {Path(to_write['src']) : Path(to_write['dst']) for to_write in cfg['write']}
+            new_mtime = os.stat(args.config).st_mtime
+            if new_mtime != cfg_mtime:
+                cfg = load_config(args.config)
+                cfg_mtime = new_mtime
+                write_pairs = None
+            if write_pairs is None:
+                write_pairs = [(to_write['src'], to_write['dst']) for to_write in cfg['write']]
+            no_write_paths, watch_paths = expand_globs(cfg, base_path)
             run_watcher(no_write_paths, write_pairs, watch_paths)
+            delay = RETRY_DELAY_MIN
         except Exception as e:
             print(f"Error: {e}")
-            print("Please check your configuration and try again, attempting to reload in 3 seconds...")
-            time.sleep(3)
+            print(f"Please check your configuration and try again, attempting to reload in {delay:.0f} seconds or when the config changes...")
+            _retry_requested = False # Only edits made after the failure should cut the wait short
+            wait_for_retry(delay + random.uniform(0, delay * 0.1))
+            delay = min(delay * 2, RETRY_DELAY_MAX)
             continue
         
@@ -1,6 +1,70 @@
 import re
+import sys
+from collections import OrderedDict
+from operator import itemgetter
 from typing import List, Dict, Tuple, Optional, Any
 
+# Patterns used on every line/tag, compiled once at import
+_RE_LEADING_WS = re.compile(r"^[ \t]*") # Indent characters only, so line breaks are never included
+_RE_TAG = re.compile(r"^(<[a-zA-Z0-9_-]+|[a-zA-Z0-9_-]+)(>?)\s*(.*)") # Capture rest after tag+>
+_RE_ATTR_TOKENS = re.compile(r'(?:[^\s"]+|"[^"]*")+') # Split by space, respecting quotes
+_RE_ARG = re.compile(r'@(\d+)')
+_NO_CLOSE = frozenset(('!doctype',)) # Lowercased tag names that never get a closing tag
+_RE_QUOTE = re.compile(r"[\"']")
+_RE_COLLAPSIBLE_WS = re.compile(r"[^\S ]|  |^ | $") # Whitespace that ' '.join(text.split()) would change
+_RE_OTHER_LINE_BREAK = re.compile('\r(?!\n)|[\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]') # Breaks str.splitlines() honours besides \n and \r\n
+_BLANK_LINE_STARTS = frozenset(('', '#//')) # First three characters of a stripped empty or comment-only line
+_first_three_chars = itemgetter(slice(3))
+_DIRECTIVE_FIRST_CHARS = frozenset('s:@!|r') # set, :macro, @, !, |, raw/raw@/rawf
+_RE_STRUCTURAL_START = re.compile(r"^\s*([a-zA-Z0-9_-]+|>|<[a-zA-Z0-9_-]+|@|!|:|set)")
+MACRO_CACHE_SIZE = 256 # Compiled macro expansions kept per compiler, least recently used are dropped
+
+def _is_run_of(text: str, char: str) -> bool:
+    """Same result as re.match(f"^{char}+$", text): one or more char, optionally followed by a final newline."""
+    if text.endswith('\n'):
+        text = text[:-1]
+    return bool(text) and text.count(char) == len(text)
+
+def _blank_flags(lines: List[str]) -> bytearray:
+    """
+    1 for each empty or comment-only line, 0 for lines with content.
+    Built from maps of C functions only: lstrip, take the first three characters, test for '' or '#//'.
+    """
+    return bytearray(map(_BLANK_LINE_STARTS.__contains__, map(_first_three_chars, map(str.lstrip, lines))))
+
+def _indent_lines(text: str, indent: str) -> str:
+    """
+    Prefixes every non-empty line of text with indent, keeping empty lines empty,
+    and ends the result with a newline (empty text stays empty).
+    Without empty lines this is a single C-level join; otherwise lines are indented one by one.
+    """
+    lines = text.splitlines()
+    if '' not in lines:
+        return indent + ('\n' + indent).join(lines) + '\n' if lines else ''
+    indented = "\n".join([f"{indent}{l}" if l else "" for l in lines])
+    # Avoid double newlines if the last line was empty
+    return indented if indented.endswith('\n') else indented + '\n'
+
+def _strip_inline_comment(line: str) -> str:
+    """
+    Removes a trailing '#//' comment (and the space before it) unless the first '#//'
+    lies inside a quoted string. Only the quote characters before it are visited.
+    """
+    comment_index = line.find('#//')
+    if comment_index == -1:
+        return line # No comment found
+    if line.find('"', 0, comment_index) == -1 and line.find("'", 0, comment_index) == -1:
+        return line[:comment_index].rstrip() # No quotes before the comment, it cannot be inside a string
+    quote_char = None
+    for char in _RE_QUOTE.findall(line, 0, comment_index):
+        if not quote_char:
+            quote_char = char
+        elif quote_char == char:
+            quote_char = None
+    if quote_char:
+        return line # Comment is inside quotes, keep it
+    return line[:comment_index].rstrip() # Remove comment and trailing space
+
 class AlthtmlCompiler:
     """
     Althtml Compiler
@@ -21,16 +85,80 @@ class AlthtmlCompiler:
     - Minimal fatal error handling (Indentation, Syntax, Undefined)
     """
 
+    # No per-instance __dict__; html_output and tag_stack are properties over these
+    __slots__ = ('_variables', '_var_pattern', '_var_names', '_var_pattern_dirty', '_var_first_chars', 'macros',
+                 '_chunks', '_indent_cache', '_stack_names', '_stack_levels', '_stack_self_closing',
+                 'current_indent_level', 'line_number', 'indent_size', 'indent_type',
+                 '_variables_shared', '_macros_shared', '_var_gen', '_gen_counter', '_macro_cache',
+                 '_line_blank', '_indent_prefix')
+
     def __init__(self):
         """Initializes the compiler state."""
-        self.variables: Dict[str, str] = {}  # Global store for variables
-        self.macros: Dict[str, Dict[str, Any]] = {} # Global store for macros { name: { definition_lines: [], is_arg_macro: bool, arg_count: int } }
-        self.html_output: str = ''
-        self.tag_stack: List[Dict[str, Any]] = [] # { tag_name: str, indent_level: int, self_closing: bool }
+        self._variables: Dict[str, str] = {}  # Global store for variables, see the variables property
+        self._var_pattern: Optional[re.Pattern] = None # Alternation of all variable names, finds texts that need substitution
+        self._var_names: Tuple[str, ...] = () # Variable names, longest first, in substitution order
+        self._var_pattern_dirty: bool = True # Set when a variable is added, rebuilds _var_pattern and _var_names lazily
+        self._var_first_chars: set = set() # First character of every variable name, rebuilt with _var_pattern
+        self.macros: Dict[str, Dict[str, Any]] = {} # Global store for macros { name: { definition_lines: [], source: str, is_arg_macro: bool, arg_count: int } }
+        self._chunks: List[str] = [] # Output fragments, joined once at the end of compile()
+        self._indent_cache: List[str] = [''] # _indent_cache[n] == '  ' * n, grown on demand
+        # Open tags, one entry per tag across three parallel lists
+        self._stack_names: List[str] = []
+        self._stack_levels: List[int] = []
+        self._stack_self_closing: List[bool] = []
         self.current_indent_level: int = 0
         self.line_number: int = 0
         self.indent_size: int = 0  # Detected size of first indent (spaces or 1 for tab)
         self.indent_type: str = '' # 'spaces' or 'tab'
+        self._indent_prefix: List[str] = [''] # _indent_prefix[n] is the source indent of level n, filled once the unit is detected
+        # True while compiling a fragment whose variables/macros still alias the parent's (copied on first write)
+        self._variables_shared: bool = False
+        self._macros_shared: bool = False
+        # Generation of the current variables/macros; every definition takes a fresh number from _gen_counter
+        self._var_gen: int = 0
+        self._gen_counter: int = 0
+        self._macro_cache: "OrderedDict[Tuple, str]" = OrderedDict() # { (macro_name, args, _var_gen): compiled macro }
+        self._line_blank: bytearray = bytearray() # 1 for each empty or comment-only line of the source being parsed
+
+    @property
+    def tag_stack(self) -> List[Dict[str, Any]]:
+        """Snapshot of the open tags as { tag_name: str, indent_level: int, self_closing: bool } dicts."""
+        return [{'tag_name': name, 'indent_level': level, 'self_closing': self_closing}
+                for name, level, self_closing in zip(self._stack_names, self._stack_levels, self._stack_self_closing)]
+
+    @property
+    def variables(self) -> Dict[str, str]:
+        """Global store for variables { name: value }."""
+        return self._variables
+
+    @variables.setter
+    def variables(self, variables: Dict[str, str]):
+        # A new dict invalidates the substitution pattern and any cached macro expansion
+        self._variables = variables
+        self._variables_shared = False
+        self._var_pattern_dirty = True
+        self._bump_generation()
+
+    @property
+    def html_output(self) -> str:
+        """The HTML generated so far (the final output once compile() returns)."""
+        return "".join(self._chunks)
+
+    def _emit(self, text: str):
+        """Appends a fragment to the output buffer. Empty fragments are skipped so _chunks[-1] is the output's tail."""
+        if text:
+            self._chunks.append(text)
+
+    def _output_ends_with_newline(self) -> bool:
+        """Checks the tail of the output buffer without joining it."""
+        return bool(self._chunks) and self._chunks[-1].endswith('\n')
+
+    def _indent(self, level: int) -> str:
+        """Returns the pretty-print indent string for an output level."""
+        cache = self._indent_cache
+        while len(cache) <= level:
+            cache.append(cache[-1] + '  ')
+        return cache[level]
 
     def _fatal_error(self, message: str):
         """Raises a fatal compilation error."""
@@ -42,11 +170,11 @@ class AlthtmlCompiler:
         Detects indent size/type on the first indented line.
         Handles mixed indentation based on detected type/size.
         """
-        match = re.match(r"^\s*", line)
-        leading_whitespace = match.group(0) if match else ""
-
-        if not leading_whitespace:
+        # str.lstrip() strips the same characters as \s, without the regex call
+        width = len(line) - len(line.lstrip())
+        if not width:
             return 0
+        leading_whitespace = line[:width]
 
         if self.indent_size == 0:
             # Detect indent type and size on first indented line
@@ -62,14 +190,15 @@ class AlthtmlCompiler:
             if self.indent_size == 0: return 0 # Avoid division by zero
 
         # Calculate level based on detected type
+        # A plain count settles the common all-tabs/all-spaces case before the full _is_run_of check
         if self.indent_type == 'tab':
-            if not re.match(r"^\t+$", leading_whitespace):
+            if leading_whitespace.count('\t') != width and not _is_run_of(leading_whitespace, '\t'):
                  print(f"Warning: Line {self.line_number}: Mixed indentation detected (tabs expected).")
                  # Attempt recovery: count tabs primarily
                  return leading_whitespace.count('\t')
-            return len(leading_whitespace) # Number of tabs
+            return width # Number of tabs
         else: # spaces
-            if not re.match(r"^ +$", leading_whitespace):
+            if leading_whitespace.count(' ') != width and not _is_run_of(leading_whitespace, ' '):
                  print(f"Warning: Line {self.line_number}: Mixed indentation detected (spaces expected).")
                  # Attempt recovery: count space groups primarily
                  # Ensure indent_size is positive before division
@@ -82,37 +211,120 @@ class AlthtmlCompiler:
                       return 0 # Fallback to level 0
 
             # Check consistency only if indent_size is positive
-            if self.indent_size > 0 and len(leading_whitespace) % self.indent_size != 0:
+            if self.indent_size > 0 and width % self.indent_size != 0:
                  self._fatal_error(f"Inconsistent space indentation. Expected multiple of {self.indent_size} spaces.")
 
             # Calculate level, handle potential division by zero if indent_size wasn't set
-            return len(leading_whitespace) // self.indent_size if self.indent_size > 0 else 0
+            return width // self.indent_size if self.indent_size > 0 else 0
 
 
     def _close_tags(self, target_level: int):
         """Closes tags on the stack until the target indentation level is reached."""
-        while self.tag_stack and self.tag_stack[-1]['indent_level'] >= target_level:
-            closing_tag = self.tag_stack.pop()
+        levels = self._stack_levels
+        names = self._stack_names
+        self_closing = self._stack_self_closing
+        chunks = self._chunks
+        indent = self._indent
+        while levels and levels[-1] >= target_level:
+            level = levels.pop()
+            tag_name = names.pop()
             # Don't add closing tag for self-closed ones or !DOCTYPE
-            if not closing_tag.get('self_closing', False) and closing_tag['tag_name'].lower() != '!doctype':
-                indent = '  ' * closing_tag['indent_level'] # Optional: pretty print indent
-                self.html_output += f"{indent}</{closing_tag['tag_name']}>\n"
+            if not self_closing.pop() and tag_name.lower() not in _NO_CLOSE:
+                chunks.append(f"{indent(level)}</{tag_name}>\n") # Optional: pretty print indent
+
+    def _set_variable(self, var_name: str, value: str):
+        """Stores a variable and invalidates the substitution pattern."""
+        if self._variables_shared:
+            # First write inside a fragment: copy so the enclosing scope is unaffected
+            self._variables = self._variables.copy()
+            self._variables_shared = False
+        self._variables[sys.intern(var_name)] = value # Interned: names are looked up and hashed repeatedly
+        self._var_pattern_dirty = True
+        self._bump_generation()
+
+    def _set_macro(self, macro_name: str, macro: Dict[str, Any]):
+        """Stores a macro definition."""
+        if self._macros_shared:
+            # First write inside a fragment: copy so the enclosing scope is unaffected
+            self.macros = self.macros.copy()
+            self._macros_shared = False
+        self.macros[sys.intern(macro_name)] = macro
+        self._bump_generation()
+
+    def _bump_generation(self):
+        """Moves to a new definitions generation so cached macro expansions from older ones no longer match."""
+        self._gen_counter += 1
+        self._var_gen = self._gen_counter
+
+    def _get_cached_macro(self, key: Tuple) -> Optional[str]:
+        """
+        Returns a previously compiled macro expansion for key, a (macro_name, args, _var_gen) tuple.
+        Within one compile() the expansion only depends on the macro body, the args and the
+        current definitions, and any definition made since it was stored changes _var_gen.
+        The cache is cleared by every compile(), since rawf reads files that may have changed.
+        """
+        compiled = self._macro_cache.get(key)
+        if compiled is not None:
+            self._macro_cache.move_to_end(key)
+        return compiled
+
+    def _store_cached_macro(self, key: Tuple, compiled: str) -> str:
+        """Stores a compiled macro expansion, evicting the least recently used one when full."""
+        cache = self._macro_cache
+        cache[key] = compiled
+        if len(cache) > MACRO_CACHE_SIZE:
+            cache.popitem(last=False)
+        return compiled
+
+    def _compile_fragment(self, source: str) -> str:
+        """
+        Compiles an isolated fragment (set block, macro body or argument) on this instance.
+        The parse state is saved and restored around the fragment; variables and macros are
+        shared with the fragment and only copied if the fragment defines new ones.
+        """
+        saved_state = (self._chunks, self._stack_names, self._stack_levels, self._stack_self_closing,
+                       self.current_indent_level, self.line_number, self.indent_size, self.indent_type,
+                       self._variables, self.macros, self._variables_shared, self._macros_shared,
+                       self._var_pattern, self._var_names, self._var_first_chars, self._var_pattern_dirty, self._var_gen,
+                       self._line_blank, self._indent_prefix)
+        self._variables_shared = True
+        self._macros_shared = True
+        try:
+            self._reset_parse_state()
+            return self._parse(source)
+        finally:
+            # Without a copy the fragment's pattern was built from the same names, so it stays valid
+            variables_untouched = self._variables_shared
+            pattern_state = (self._var_pattern, self._var_names, self._var_first_chars, self._var_pattern_dirty)
+            (self._chunks, self._stack_names, self._stack_levels, self._stack_self_closing,
+             self.current_indent_level, self.line_number, self.indent_size, self.indent_type,
+             self._variables, self.macros, self._variables_shared, self._macros_shared,
+             self._var_pattern, self._var_names, self._var_first_chars, self._var_pattern_dirty, self._var_gen,
+             self._line_blank, self._indent_prefix) = saved_state
+            if variables_untouched:
+                self._var_pattern, self._var_names, self._var_first_chars, self._var_pattern_dirty = pattern_state
 
     def _substitute_variables(self, text: str) -> str:
-        """Performs variable substitution on a string segment."""
-        substituted_text = text
-        # Sort keys by length descending to match longer names first
-        var_names = sorted(self.variables.keys(), key=len, reverse=True)
-        for var_name in var_names:
-            # Use regex with word boundaries to avoid partial matches
-            # Ensure var_name is properly escaped for regex if needed, though simple names should be fine
-            try:
-                # Using simple replace as per spec (no word boundary check)
-                substituted_text = substituted_text.replace(var_name, self.variables[var_name])
-            except re.error:
-                 # Fallback to simple replace if regex fails (e.g., bad var name)
-                 substituted_text = substituted_text.replace(var_name, self.variables[var_name])
-        return substituted_text
+        """
+        Performs variable substitution on a string segment.
+        Names are replaced longest first, each replacement working on the result of the previous
+        ones, so a value may itself refer to shorter variable names.
+        """
+        variables = self._variables
+        # The length check catches names added to the dict directly
+        if self._var_pattern_dirty or len(variables) != len(self._var_names):
+            self._var_first_chars = {var_name[0] for var_name in variables}
+            # Sort keys by length descending to match longer names first
+            self._var_names = var_names = tuple(sorted(variables, key=len, reverse=True))
+            self._var_pattern = re.compile('|'.join(map(re.escape, var_names))) if var_names else None
+            self._var_pattern_dirty = False
+        # Most text references no variable: one C-level scan for a possible first character, then one regex search
+        if self._var_pattern is None or self._var_first_chars.isdisjoint(text) or not self._var_pattern.search(text):
+            return text
+        for var_name in self._var_names:
+            if var_name in text:
+                text = text.replace(var_name, variables.get(var_name, var_name))
+        return text
 
     def _parse_attributes(self, attr_string: str) -> str:
         """
@@ -123,65 +335,49 @@ class AlthtmlCompiler:
         if not attr_string:
             return ''
 
-        other_attrs = '' # Store attributes like name=value, data-*, etc.
-        id_value = ''
+        id_parts = [] # Values of '#' tokens, concatenated into the id
         explicit_classes = [] # Classes from class="val1 val2"
         implicit_classes = [] # Bare words treated as classes
+        other_attrs = [] # Pre-formatted attributes like name=value, data-*, etc.
 
-        # Regex to split by space, respecting quotes
-        tokens = re.findall(r'(?:[^\s"]+|"[^"]*")+', attr_string)
-
-        for token in tokens:
-            token = self._substitute_variables(token) # Substitute variables in the token itself first
-
-            if token.startswith('#'):
+        # Substitute variables once over the whole string, then split by space, respecting quotes.
+        # A value containing spaces therefore yields several tokens (e.g. several classes).
+        for token in _RE_ATTR_TOKENS.findall(self._substitute_variables(attr_string)):
+            if token[0] == '#':
                 # ID Shortcut - substitute variables is already done
-                id_value += token[1:]
-            elif '=' in token:
-                # Standard attribute name=value or name="value"
-                parts = token.split('=', 1)
-                name = parts[0]
-                value = parts[1]
-                # Remove quotes if present, handle escaped quotes
-                if value.startswith('"') and value.endswith('"'):
-                    value = value[1:-1].replace('\\"', '"')
-
-                substituted_value = value # Value after initial token substitution
-
-                # Basic escaping for the attribute value itself in HTML output
-                escaped_value = substituted_value.replace('"', '&quot;')
-
-                if name.lower() == 'class':
-                    # Collect explicitly defined classes
-                    explicit_classes.extend(escaped_value.split())
-                else:
-                    # Add other attributes directly
-                    other_attrs += f' {name}="{escaped_value}"' # Always quote attribute values
-            else:
+                id_parts.append(token[1:])
+                continue
+            # Standard attribute name=value or name="value", split on the first '='
+            name, is_attr, value = token.partition('=')
+            if not is_attr:
                 # Treat as implicit class name as per user request
                 implicit_classes.append(token)
-
-
-        # Combine classes
-        all_classes = implicit_classes + explicit_classes
-        class_string = ""
-        if all_classes:
-             # Remove duplicates while preserving order (simple approach)
-             unique_classes = []
-             for cls in all_classes:
-                 if cls not in unique_classes:
-                     unique_classes.append(cls)
-             class_string = f' class="{" ".join(unique_classes)}"'
-
+                continue
+            # Remove quotes if present, handle escaped quotes
+            if value.startswith('"') and value.endswith('"'):
+                value = value[1:-1].replace('\\"', '"')
+            # Basic escaping for the attribute value itself in HTML output
+            escaped_value = value.replace('"', '&quot;')
+            if name.lower() == 'class':
+                # Collect explicitly defined classes
+                explicit_classes.extend(escaped_value.split())
+            else:
+                other_attrs.append(f' {name}="{escaped_value}"') # Always quote attribute values
 
         # Combine ID
         id_string = ""
+        id_value = "".join(id_parts)
         if id_value:
             # Basic escaping for the final ID value
             escaped_id = id_value.replace('"', '&quot;')
             id_string = f' id="{escaped_id}"'
 
-        return id_string + class_string + other_attrs # Order: id, class, others
+        # Combine classes, removing duplicates while preserving order (dict keys keep insertion order)
+        class_string = ""
+        if implicit_classes or explicit_classes:
+            class_string = f' class="{" ".join(dict.fromkeys(implicit_classes + explicit_classes))}"'
+
+        return id_string + class_string + "".join(other_attrs) # Order: id, class, others
 
 
     def _process_line(self, line_content: str, indent_level: int, lines: List[str], current_index: int) -> int:
@@ -192,26 +388,7 @@ class AlthtmlCompiler:
         self.line_number = current_index + 1 # For error reporting
 
         # --- Strip inline comment FIRST ---
-        comment_index = line_content.find('#//')
-        if comment_index != -1:
-            # Check if the comment is inside quotes - basic check
-            in_quotes = False
-            quote_char = None
-            for i in range(comment_index):
-                char = line_content[i]
-                if char in ('"', "'") and (i == 0 or line_content[i-1] != '#\\'):
-                    if not quote_char:
-                        quote_char = char
-                        in_quotes = True
-                    elif quote_char == char:
-                        quote_char = None
-                        in_quotes = False
-            if not in_quotes:
-                line = line_content[:comment_index].rstrip() # Remove comment and trailing space
-            else:
-                line = line_content # Comment is inside quotes, keep it
-        else:
-            line = line_content # No comment found
+        line = _strip_inline_comment(line_content)
 
 
         # --- Handle Indentation ---
@@ -223,119 +400,123 @@ class AlthtmlCompiler:
              self._close_tags(indent_level)
 
         # If indent level stayed same, close previous tag of same level *before* processing
-        if indent_level == self.current_indent_level and self.tag_stack and self.tag_stack[-1]['indent_level'] == indent_level:
+        if indent_level == self.current_indent_level and self._stack_levels and self._stack_levels[-1] == indent_level:
              self._close_tags(indent_level)
 
         # Update current level *after* potential closing, *before* processing line content
         self.current_indent_level = indent_level
-        output_indent = '  ' * indent_level # Optional: pretty print indent
+        output_indent = self._indent(indent_level) # Optional: pretty print indent
 
         # --- Skip Empty Lines (after comment removal) ---
         if not line:
             # Even if line is empty, indentation might have closed tags above
             return 1 # Consume 1 line
 
-        # --- Handle Keywords: set, :macro ---
-        if line.startswith('set '):
-            consumed = self._handle_set(line, indent_level, lines, current_index)
-            return consumed
-        if line.startswith(':macro '):
-            consumed = self._handle_macro_definition(line, indent_level, lines, current_index)
-            return consumed
-
-        # --- Handle Macro Invocation: @ ---
-        if line.startswith('@'):
-            self._handle_macro_invocation(line, indent_level)
-            return 1 # Consume 1 line
-
-        # --- Handle Macro Call: ! ---
-        if line.startswith('!'):
-            consumed = self._handle_macro_call(line, indent_level, lines, current_index)
-            return consumed
-
-        # --- Handle Explicit Text Line: | ---
-        # Check for lines starting *only* with | (after stripping comments)
-        if line.startswith('|'):
-            text_content = line[1:].lstrip() # Preserve leading space after |
-            substituted_text = self._substitute_variables(text_content)
-            # Add text indented relative to the *parent* tag
-            parent_indent_level = self.tag_stack[-1]['indent_level'] if self.tag_stack else -1
-            text_indent_str = '  ' * (parent_indent_level + 1)
-            self.html_output += f"{text_indent_str}{substituted_text}\n"
-            return 1 # Consumed 1 line
-
-        # --- SPECIAL HANDLING FOR 'raw' DIRECTIVE (block) ---
-        if line == 'raw':
-            # Get the block content
-            raw_block_lines = self._get_block_lines(indent_level, lines, current_index)
-            # Dedent the raw content
-            dedented_content = self._dedent_block(raw_block_lines, indent_level + 1)
-            # Output dedented content literally (no variable substitution)
-            parent_indent_level = self.tag_stack[-1]['indent_level'] if self.tag_stack else -1
-            raw_indent_str = '  ' * (parent_indent_level + 1)
-            for content_line in dedented_content:
-                 self.html_output += raw_indent_str + content_line # Includes original line ending
-            return 1 + len(raw_block_lines) # Consumed 'raw' line + block lines
-        # --- END SPECIAL HANDLING FOR 'raw' DIRECTIVE (block) ---
-
-        # --- SPECIAL HANDLING FOR 'raw ' DIRECTIVE (line) ---
-        if line.startswith('raw '):
-            text_content = line[4:] # Get content after 'raw '
-            # Output literally, no variable substitution
-            parent_indent_level = self.tag_stack[-1]['indent_level'] if self.tag_stack else -1
-            raw_indent_str = '  ' * (parent_indent_level + 1)
-            self.html_output += f"{raw_indent_str}{text_content}\n"
-            return 1 # Consumed 1 line
-        # --- END SPECIAL HANDLING FOR 'raw ' DIRECTIVE (line) ---
-
-        # --- SPECIAL HANDLING FOR 'raw@' DIRECTIVE (block) ---
-        if line == 'raw@':
-            # Get the block content
-            raw_block_lines = self._get_block_lines(indent_level, lines, current_index)
-            # Dedent the raw content
-            dedented_content_lines = self._dedent_block(raw_block_lines, indent_level + 1)
-            # Join lines, THEN substitute variables
-            raw_text = "".join(dedented_content_lines)
-            substituted_text = self._substitute_variables(raw_text)
-            # Output substituted content, indented relative to parent
-            parent_indent_level = self.tag_stack[-1]['indent_level'] if self.tag_stack else -1
-            raw_indent_str = '  ' * (parent_indent_level + 1)
-            # Add indent to each line of the potentially multi-line substituted text
-            for output_line in substituted_text.splitlines(keepends=True):
-                 self.html_output += raw_indent_str + output_line
-            # Ensure a final newline if the original content didn't end with one but wasn't empty
-            if substituted_text and not self.html_output.endswith('\n'):
-                 self.html_output += '\n'
-            return 1 + len(raw_block_lines) # Consumed 'raw@' line + block lines
-        # --- END SPECIAL HANDLING FOR 'raw@' DIRECTIVE (block) ---
-
-        # --- SPECIAL HANDLING FOR 'raw@ ' DIRECTIVE (line) ---
-        if line.startswith('raw@ '):
-            text_content = line[5:] # Get content after 'raw@ '
-            # Substitute variables, then output literally
-            substituted_text = self._substitute_variables(text_content)
-            parent_indent_level = self.tag_stack[-1]['indent_level'] if self.tag_stack else -1
-            raw_indent_str = '  ' * (parent_indent_level + 1)
-            self.html_output += f"{raw_indent_str}{substituted_text}\n"
-            return 1 # Consumed 1 line
-        # --- END SPECIAL HANDLING FOR 'raw@ ' DIRECTIVE (line) ---
-
-        if line.startswith('rawf '):
-            text_content = open(line[5:].strip(), "r+").read()
-            parent_indent_level = self.tag_stack[-1]['indent_level'] if self.tag_stack else -1
-            raw_indent_str = '  ' * (parent_indent_level + 1)
-            raw_block_lines = text_content.splitlines(keepends=True)
-            for output_line in raw_block_lines:
-                    self.html_output += raw_indent_str + output_line
-            # Ensure a final newline if the original content didn't end with one but wasn't empty
-            if text_content and not self.html_output.endswith('\n'):
-                 self.html_output += '\n'
-            return 1
-        
-
+        # --- Directives: only lines starting with one of their first characters can be one ---
+        if line[0] in _DIRECTIVE_FIRST_CHARS:
+            # --- Handle Keywords: set, :macro ---
+            if line.startswith('set '):
+                consumed = self._handle_set(line, indent_level, lines, current_index)
+                return consumed
+            if line.startswith(':macro '):
+                consumed = self._handle_macro_definition(line, indent_level, lines, current_index)
+                return consumed
+
+            # --- Handle Macro Invocation: @ ---
+            if line.startswith('@'):
+                self._handle_macro_invocation(line, indent_level)
+                return 1 # Consume 1 line
+
+            # --- Handle Macro Call: ! ---
+            if line.startswith('!'):
+                consumed = self._handle_macro_call(line, indent_level, lines, current_index)
+                return consumed
+
+            # --- Handle Explicit Text Line: | ---
+            # Check for lines starting *only* with | (after stripping comments)
+            if line.startswith('|'):
+                text_content = line[1:].lstrip() # Preserve leading space after |
+                substituted_text = self._substitute_variables(text_content)
+                # Add text indented relative to the *parent* tag
+                parent_indent_level = self._stack_levels[-1] if self._stack_levels else -1
+                text_indent_str = self._indent(parent_indent_level + 1)
+                self._emit(f"{text_indent_str}{substituted_text}\n")
+                return 1 # Consumed 1 line
+
+            # --- SPECIAL HANDLING FOR 'raw' DIRECTIVE (block) ---
+            if line == 'raw':
+                # Get the block content
+                raw_block_lines = self._get_block_lines(indent_level, lines, current_index)
+                # Dedent the raw content
+                dedented_content = self._dedent_block(raw_block_lines, indent_level + 1)
+                # Output dedented content literally (no variable substitution)
+                parent_indent_level = self._stack_levels[-1] if self._stack_levels else -1
+                raw_indent_str = self._indent(parent_indent_level + 1)
+                for content_line in dedented_content:
+                     self._emit(raw_indent_str + content_line) # Includes original line ending
+                return 1 + len(raw_block_lines) # Consumed 'raw' line + block lines
+            # --- END SPECIAL HANDLING FOR 'raw' DIRECTIVE (block) ---
+
+            # --- SPECIAL HANDLING FOR 'raw ' DIRECTIVE (line) ---
+            if line.startswith('raw '):
+                text_content = line[4:] # Get content after 'raw '
+                # Output literally, no variable substitution
+                parent_indent_level = self._stack_levels[-1] if self._stack_levels else -1
+                raw_indent_str = self._indent(parent_indent_level + 1)
+                self._emit(f"{raw_indent_str}{text_content}\n")
+                return 1 # Consumed 1 line
+            # --- END SPECIAL HANDLING FOR 'raw ' DIRECTIVE (line) ---
+
+            # --- SPECIAL HANDLING FOR 'raw@' DIRECTIVE (block) ---
+            if line == 'raw@':
+                # Get the block content
+                raw_block_lines = self._get_block_lines(indent_level, lines, current_index)
+                # Dedent the raw content into one string, THEN substitute variables
+                raw_text = self._dedent_text(raw_block_lines, indent_level + 1)
+                substituted_text = self._substitute_variables(raw_text)
+                # Output substituted content, indented relative to parent
+                parent_indent_level = self._stack_levels[-1] if self._stack_levels else -1
+                raw_indent_str = self._indent(parent_indent_level + 1)
+                # Add indent to each line of the potentially multi-line substituted text
+                if not _RE_OTHER_LINE_BREAK.search(substituted_text):
+                    # Only '\n' line breaks: indent them all with one replace, skipping the final one
+                    if substituted_text:
+                        body = substituted_text[:-1] if substituted_text.endswith('\n') else substituted_text
+                        self._emit(raw_indent_str + body.replace('\n', '\n' + raw_indent_str) + '\n')
+                else:
+                    for output_line in substituted_text.splitlines(keepends=True):
+                         self._emit(raw_indent_str + output_line)
+                    # Ensure a final newline if the original content didn't end with one but wasn't empty
+                    if substituted_text and not self._output_ends_with_newline():
+                         self._emit('\n')
+                return 1 + len(raw_block_lines) # Consumed 'raw@' line + block lines
+            # --- END SPECIAL HANDLING FOR 'raw@' DIRECTIVE (block) ---
+
+            # --- SPECIAL HANDLING FOR 'raw@ ' DIRECTIVE (line) ---
+            if line.startswith('raw@ '):
+                text_content = line[5:] # Get content after 'raw@ '
+                # Substitute variables, then output literally
+                substituted_text = self._substitute_variables(text_content)
+                parent_indent_level = self._stack_levels[-1] if self._stack_levels else -1
+                raw_indent_str = self._indent(parent_indent_level + 1)
+                self._emit(f"{raw_indent_str}{substituted_text}\n")
+                return 1 # Consumed 1 line
+            # --- END SPECIAL HANDLING FOR 'raw@ ' DIRECTIVE (line) ---
+
+            if line.startswith('rawf '):
+                text_content = open(line[5:].strip(), "r+").read()
+                parent_indent_level = self._stack_levels[-1] if self._stack_levels else -1
+                raw_indent_str = self._indent(parent_indent_level + 1)
+                raw_block_lines = text_content.splitlines(keepends=True)
+                for output_line in raw_block_lines:
+                        self._emit(raw_indent_str + output_line)
+                # Ensure a final newline if the original content didn't end with one but wasn't empty
+                if text_content and not self._output_ends_with_newline():
+                     self._emit('\n')
+                return 1
 
         # --- Handle Tags and Implicit Text ---
-        tag_match = re.match(r"^(<[a-zA-Z0-9_-]+|[a-zA-Z0-9_-]+)(>?)\s*(.*)", line) # Capture rest after tag+>
+        tag_match = _RE_TAG.match(line) # Capture rest after tag+>
         pipe_index = line.find('|') # Find pipe in the potentially comment-stripped line
 
         tag_name = ''
@@ -370,16 +551,18 @@ class AlthtmlCompiler:
         if tag_name:
             # --- Standard Tag Processing ---
             attributes = self._parse_attributes(attr_str)
-            self.html_output += f"{output_indent}<{tag_name}{attributes}{' /' if is_self_closing else ''}>\n"
+            self._emit(f"{output_indent}<{tag_name}{attributes}{' /' if is_self_closing else ''}>\n")
 
             if not is_self_closing:
                 # Push onto stack BEFORE processing potential text content
-                self.tag_stack.append({'tag_name': tag_name, 'indent_level': indent_level, 'self_closing': False})
+                self._stack_names.append(sys.intern(tag_name)) # Same tag names recur on every open/close
+                self._stack_levels.append(indent_level)
+                self._stack_self_closing.append(False)
                 if text_content:
                     # Explicit text after | - preserve whitespace, substitute vars
                     substituted_text = self._substitute_variables(text_content)
                     # Add text indented appropriately inside the new tag (parent indent + 1)
-                    self.html_output += f"{output_indent}  {substituted_text}\n"
+                    self._emit(f"{self._indent(indent_level + 1)}{substituted_text}\n")
 
             elif text_content:
                  # Text after | on a self-closing tag - normally ignored
@@ -394,17 +577,17 @@ class AlthtmlCompiler:
                  # Quoted implicit text: remove quotes, preserve internal whitespace
                  processed_text = text_content[1:-1]
             else:
-                 # Unquoted implicit text: collapse whitespace
-                 processed_text = ' '.join(text_content.split())
+                 # Unquoted implicit text: collapse whitespace (only rebuilt if there is anything to collapse)
+                 processed_text = ' '.join(text_content.split()) if _RE_COLLAPSIBLE_WS.search(text_content) else text_content
 
             # Substitute variables
             substituted_text = self._substitute_variables(processed_text)
 
             # Add text indented relative to the *parent* tag
-            parent_indent_level = self.tag_stack[-1]['indent_level'] if self.tag_stack else -1
+            parent_indent_level = self._stack_levels[-1] if self._stack_levels else -1
             # Text should be indented one level deeper than parent
-            text_indent_str = '  ' * (parent_indent_level + 1)
-            self.html_output += f"{text_indent_str}{substituted_text}\n"
+            text_indent_str = self._indent(parent_indent_level + 1)
+            self._emit(f"{text_indent_str}{substituted_text}\n")
 
         return 1 # Consumed 1 line
 
@@ -423,24 +606,20 @@ class AlthtmlCompiler:
                 value = value[1:-1].replace('\\"', '"')
             else:
                 self._fatal_error(f"Inline set value for '{var_name}' must be enclosed in double quotes.")
-            self.variables[var_name] = value
+            self._set_variable(var_name, value)
             return 1 # Consumed 1 line
         else:
             # Block assignment: set var \n ...block...
             block_lines_raw = self._get_block_lines(indent_level, lines, current_index)
             if not block_lines_raw:
-                self.variables[var_name] = "" # Set to empty string if block is empty
+                self._set_variable(var_name, "") # Set to empty string if block is empty
                 return 1 # Consumed only the 'set' line
 
             # Find first non-comment/empty line in the raw block
-            first_real_line_index = 0
-            while first_real_line_index < len(block_lines_raw) and \
-                  (not block_lines_raw[first_real_line_index].strip() or \
-                   block_lines_raw[first_real_line_index].strip().startswith('#//')):
-                first_real_line_index += 1
-
-            if first_real_line_index == len(block_lines_raw): # Block only comments/empty
-                self.variables[var_name] = "" # Treat as empty block
+            first_real_line_index = _blank_flags(block_lines_raw).find(0)
+
+            if first_real_line_index == -1: # Block only comments/empty
+                self._set_variable(var_name, "") # Treat as empty block
                 return 1 + len(block_lines_raw)
 
 
@@ -450,18 +629,13 @@ class AlthtmlCompiler:
                 # Raw block
                 # Need to dedent starting from the line *after* 'raw'
                 start_index_for_dedent = first_real_line_index + 1
-                raw_content_lines = self._dedent_block(block_lines_raw[start_index_for_dedent:], indent_level + 1)
-                self.variables[var_name] = "".join(raw_content_lines) # Join without adding extra newlines
+                self._set_variable(var_name, self._dedent_text(block_lines_raw[start_index_for_dedent:], indent_level + 1))
             else:
                 # HTML Fragment block - Compile the block in isolation
-                fragment_compiler = AlthtmlCompiler()
-                # Pass existing definitions for substitution within the fragment
-                fragment_compiler.variables = self.variables.copy()
-                fragment_compiler.macros = self.macros.copy() # Shallow copy ok? Deepcopy if macros modify state internally
-                # Dedent block lines for sub-compiler (use the original raw block)
-                dedented_lines = self._dedent_block(block_lines_raw, indent_level + 1)
-                # Compile the fragment
-                self.variables[var_name] = fragment_compiler.compile("".join(dedented_lines)) # Join without adding extra newlines
+                # Dedent block lines for the fragment (use the original raw block)
+                dedented_source = self._dedent_text(block_lines_raw, indent_level + 1)
+                # Compile the fragment, existing definitions are available for substitution within it
+                self._set_variable(var_name, self._compile_fragment(dedented_source))
 
             return 1 + len(block_lines_raw) # Consumed 'set' line + block lines
 
@@ -481,21 +655,17 @@ class AlthtmlCompiler:
         # Dedent the macro body to be relative to level 0 for storage
         definition_lines = self._dedent_block(definition_lines_raw, indent_level + 1)
 
-        # Simple check for argument count
+        # Prepare the text compiled on expansion once here, instead of on every invocation/call
         arg_count = 0
         if is_arg_macro:
-            arg_regex = re.compile(r'@(\d+)')
-            max_arg = -1
-            for def_line in definition_lines:
-                 # Strip comments from definition lines before checking args
-                 clean_def_line = def_line.split('#//')[0]
-                 matches = arg_regex.findall(clean_def_line)
-                 for match in matches:
-                     max_arg = max(max_arg, int(match))
-            arg_count = max_arg + 1 if max_arg > -1 else 0
-
-
-        self.macros[macro_name] = {'definition_lines': definition_lines, 'is_arg_macro': is_arg_macro, 'arg_count': arg_count}
+            # Strip comments from definition lines before substitution, @n placeholders are filled in per call
+            source = "\n".join([l.partition('#//')[0].rstrip() for l in definition_lines]) # Use newline for joining template lines
+            # Simple check for argument count
+            arg_count = max(map(int, _RE_ARG.findall(source)), default=-1) + 1
+        else:
+            source = "".join(definition_lines) # Join without adding extra newlines
+
+        self._set_macro(macro_name, {'definition_lines': definition_lines, 'source': source, 'is_arg_macro': is_arg_macro, 'arg_count': arg_count})
         return 1 + len(definition_lines_raw) # Consumed ':macro' line + block lines
 
     def _handle_macro_invocation(self, line: str, indent_level: int):
@@ -511,21 +681,14 @@ class AlthtmlCompiler:
         if macro['is_arg_macro']:
             self._fatal_error(f"Cannot invoke argument macro '@{macro_name}' using '@'. Use '!{macro_name}'.")
 
-        # Compile the macro definition lines in isolation
-        macro_compiler = AlthtmlCompiler()
-        macro_compiler.variables = self.variables.copy()
-        macro_compiler.macros = self.macros.copy() # Pass macro defs too
+        # Compile the macro definition lines in isolation, reusing the result while no definition changes
+        key = (macro_name, (), self._var_gen)
+        compiled_macro = self._get_cached_macro(key)
+        if compiled_macro is None:
+            compiled_macro = self._store_cached_macro(key, self._compile_fragment(macro['source']))
 
-        compiled_macro = macro_compiler.compile("".join(macro['definition_lines'])) # Join without adding extra newlines
-
-        # Add the compiled output, adjusting indentation
-        output_indent_str = '  ' * indent_level
-        # Indent non-empty lines of the compiled output
-        indented_output = "\n".join([f"{output_indent_str}{l}" if l else "" for l in compiled_macro.splitlines()])
-        # Avoid double newlines if compiled_macro already ends with one
-        self.html_output += indented_output
-        if compiled_macro and not indented_output.endswith('\n'): # Add newline if output wasn't empty
-             self.html_output += "\n"
+        # Add the compiled output, adjusting indentation of its non-empty lines
+        self._emit(_indent_lines(compiled_macro, self._indent(indent_level)))
 
 
     def _handle_macro_call(self, line: str, indent_level: int, lines: List[str], current_index: int) -> int:
@@ -542,7 +705,8 @@ class AlthtmlCompiler:
             self._fatal_error(f"Cannot call simple macro '!{macro_name}' using '!'. Use '@{macro_name}'.")
 
         # 1. Get argument blocks
-        arg_blocks_raw = self._get_argument_blocks(indent_level, lines, current_index)
+        arg_ranges = self._get_argument_blocks(indent_level, lines, current_index)
+        arg_blocks_raw = [lines[start:end] for start, end in arg_ranges]
 
         if len(arg_blocks_raw) != macro['arg_count']:
             self._fatal_error(f"Macro '!{macro_name}' expected {macro['arg_count']} arguments, but received {len(arg_blocks_raw)}.")
@@ -555,32 +719,25 @@ class AlthtmlCompiler:
                 continue
 
             # Find first real line (ignoring comments/empty)
-            first_real_line_index = 0
-            while first_real_line_index < len(arg_block) and \
-                  (not arg_block[first_real_line_index].strip() or \
-                   arg_block[first_real_line_index].strip().startswith('#//')):
-                first_real_line_index += 1
+            blank_flags = _blank_flags(arg_block)
+            first_real_line_index = blank_flags.find(0)
 
-            if first_real_line_index == len(arg_block): # Block was only comments/empty
+            if first_real_line_index == -1: # Block was only comments/empty
                  args.append("")
                  continue
 
             first_real_line = arg_block[first_real_line_index]
             # Strip comment from the first real line before checking its structure
-            first_real_line_content = first_real_line.split('#//')[0].rstrip()
+            first_real_line_content = first_real_line.partition('#//')[0].rstrip()
             first_real_line_trimmed = first_real_line_content.strip()
 
 
             # Check if it looks like a tag/keyword start on the first *real* line's content
-            is_simple_text = not re.match(r"^\s*([a-zA-Z0-9_-]+|>|<[a-zA-Z0-9_-]+|@|!|:|set)", first_real_line_content) \
+            is_simple_text = not _RE_STRUCTURAL_START.match(first_real_line_content) \
                              or first_real_line_trimmed.startswith('|')
 
             # Check if block contains only one real line + comments/empty
-            is_single_real_line = True
-            for j in range(first_real_line_index + 1, len(arg_block)):
-                 if arg_block[j].strip() and not arg_block[j].strip().startswith('#//'):
-                     is_single_real_line = False
-                     break
+            is_single_real_line = blank_flags.find(0, first_real_line_index + 1) == -1
 
             if is_simple_text and is_single_real_line:
                 # Simple text argument (potentially with |)
@@ -590,133 +747,116 @@ class AlthtmlCompiler:
                 args.append(self._substitute_variables(text)) # Substitute variables
             else:
                 # Structural argument - compile it
-                arg_compiler = AlthtmlCompiler()
-                arg_compiler.variables = self.variables.copy()
-                arg_compiler.macros = self.macros.copy()
                 # Dedent the *whole* original block for compilation
-                dedented_lines = self._dedent_block(arg_block, indent_level + 1)
-                args.append(arg_compiler.compile("".join(dedented_lines))) # Join without adding extra newlines
-
-        # 3. Substitute arguments into macro definition
-        # Strip comments from definition lines before substitution
-        clean_definition_lines = [l.split('#//')[0].rstrip() for l in macro['definition_lines']]
-        substituted_definition = "\n".join(clean_definition_lines) # Use newline for joining template lines
+                args.append(self._compile_fragment(self._dedent_text(arg_block, indent_level + 1)))
 
-        # Replace arguments carefully, maybe from highest index to lowest
-        for i in range(macro['arg_count'] -1, -1, -1):
-             substituted_definition = substituted_definition.replace(f"@{i}", args[i])
+        # 3. Reuse the expansion if the macro was already called with the same arguments and definitions
+        key = (macro_name, tuple(args), self._var_gen)
+        compiled_macro = self._get_cached_macro(key)
+        if compiled_macro is None:
+            # 4. Substitute arguments into the comment-free macro definition
+            substituted_definition = macro['source']
 
+            # Replace arguments carefully, maybe from highest index to lowest
+            for i in range(macro['arg_count'] -1, -1, -1):
+                 substituted_definition = substituted_definition.replace(f"@{i}", args[i])
 
-        # 4. Compile the substituted definition
-        macro_compiler = AlthtmlCompiler()
-        macro_compiler.variables = self.variables.copy()
-        macro_compiler.macros = self.macros.copy() # Pass definitions for nested calls
-        compiled_macro = macro_compiler.compile(substituted_definition) # Pass as single string
+            # Compile the substituted definition
+            compiled_macro = self._store_cached_macro(key, self._compile_fragment(substituted_definition)) # Pass as single string
 
         # 5. Add compiled output with correct indentation
-        output_indent_str = '  ' * indent_level
-        indented_output = "\n".join([f"{output_indent_str}{l}" if l else "" for l in compiled_macro.splitlines()])
-        self.html_output += indented_output
-        if compiled_macro and not indented_output.endswith('\n'): # Add newline if output wasn't empty
-             self.html_output += "\n"
+        self._emit(_indent_lines(compiled_macro, self._indent(indent_level)))
 
 
-        # Calculate consumed lines
-        consumed = 1 # The '!' line itself
-        for block in arg_blocks_raw:
-            consumed += len(block)
-        return consumed
+        # Calculate consumed lines: the '!' line itself plus the argument blocks
+        return 1 + sum([end - start for start, end in arg_ranges])
 
     # --- Helper Methods ---
 
     def _get_block_lines(self, parent_indent_level: int, lines: List[str], parent_index: int) -> List[str]:
         """Extracts lines belonging to a block indented relative to a parent line."""
         block_lines: List[str] = []
+        blank = self._line_blank
         i = parent_index + 1
         while i < len(lines):
             line = lines[i]
             # Need to get indent level first to check against parent
             level = self._get_indent_level(line) # Use original line for indent
 
-            # Strip comment *after* getting indent, before checking content
-            line_content = line.split('#//')[0].rstrip()
-
             if level > parent_indent_level:
                 block_lines.append(line) # Add original line to preserve comments/indent
-            elif level <= parent_indent_level and line_content: # Non-empty content line ends block
+            elif not blank[i]: # Non-empty content line ends block
                 break
-            elif not line_content: # Keep empty lines if they don't break indent
-                 if block_lines: # Only keep empty lines inside a block
-                     block_lines.append(line)
-                 # If empty line is first potential line of block, ignore it unless needed?
-            else: # Line breaks the block structure (lower indent or comment at wrong level?)
-                 break
+            elif block_lines: # Keep empty lines if they don't break indent, only inside a block
+                block_lines.append(line)
             i += 1
         return block_lines
 
 
-    def _get_argument_blocks(self, call_indent_level: int, lines: List[str], call_index: int) -> List[List[str]]:
+    def _get_argument_blocks(self, call_indent_level: int, lines: List[str], call_index: int) -> List[Tuple[int, int]]:
         """
-        Extracts argument blocks following a '!' macro call.
-        Assumes arguments are consecutive blocks starting at the next indent level.
+        Finds the argument blocks following a '!' macro call, as (start, end) index ranges into lines.
+        Assumes arguments are consecutive blocks starting at the next indent level,
+        so each block ends where the next one starts.
         """
-        arg_blocks: List[List[str]] = []
-        current_arg_block: List[str] = []
-        i = call_index + 1
+        starts: List[int] = [] # Index of the first line of each argument block
+        blank = self._line_blank
         expected_indent = call_indent_level + 1
-        parsing_args = False # Flag to indicate if we are currently inside any arg block structure
-
+        i = call_index + 1
         while i < len(lines):
-            line = lines[i]
-            level = self._get_indent_level(line) # Use original line for indent level
-            line_content = line.split('#//')[0].rstrip() # Content without comment
-            line_trimmed_content = line_content.strip() # Trimmed content
+            level = self._get_indent_level(lines[i]) # Use original line for indent level
 
             if level > call_indent_level:
                 # Line is indented potentially as part of an argument
-                if level == expected_indent and line_trimmed_content:
-                    # Line is at the expected level and has content
-                    # Potential start of a new argument block OR continuation if already parsing
-                    if current_arg_block and parsing_args: # Finish previous block, start new one
-                         arg_blocks.append(current_arg_block)
-                    current_arg_block = [line] # Start new block with original line
-                    parsing_args = True # We are now officially parsing args
-                elif parsing_args:
-                     # Line is deeper than expected_indent or is comment/empty - belongs to current block
-                     current_arg_block.append(line) # Add original line
-                # else: line is indented but not at expected level and we haven't started parsing - ignore
-
-            elif parsing_args:
+                if level == expected_indent and not blank[i]:
+                    # Line is at the expected level and has content: start of a new argument block
+                    starts.append(i)
+                # else: deeper, comment or empty lines belong to the current block,
+                # or are ignored if no block has started yet
+            elif starts:
                  # Indent level dropped or is equal, and we were parsing args -> end of all args
                  break
-            elif not line_trimmed_content: # Allow empty lines between call and first arg
+            elif blank[i]: # Allow empty lines between call and first arg
                  pass
             else: # Line is not indented enough and we haven't started - means no args or done
                  break
 
             i += 1
 
-        # Add the last collected argument block
-        if current_arg_block and parsing_args:
-            arg_blocks.append(current_arg_block)
-
-        return arg_blocks
+        return list(zip(starts, starts[1:] + [i]))
 
 
     def _get_indent_chars(self, level: int) -> str:
         """Gets the whitespace string for a given indent level."""
         if level < 0: level = 0 # Safety check
-        if self.indent_size == 0 and level > 0: return "" # Indent not detected yet
+        prefixes = self._indent_prefix
+        if level < len(prefixes):
+            return prefixes[level]
+        if self.indent_size == 0: return "" # Indent not detected yet, nothing to cache
         if self.indent_type == 'tab':
-            return '\t' * level
+            unit = '\t'
         elif self.indent_type == 'spaces':
-            # Ensure indent_size is positive
-            size = self.indent_size if self.indent_size > 0 else 1
-            return ' ' * (level * size)
-        else: # level == 0 or indent not detected
+            unit = ' ' * self.indent_size
+        else: # indent not detected
              return ""
+        while len(prefixes) <= level:
+            prefixes.append(prefixes[-1] + unit)
+        return prefixes[level]
 
 
+    def _dedent_text(self, block_lines: List[str], base_indent_level: int) -> str:
+        """
+        Same as "".join(self._dedent_block(block_lines, base_indent_level)).
+        When every line starts with the base indent, it is removed with one str.replace over the joined block.
+        """
+        base_indent_chars = self._get_indent_chars(base_indent_level)
+        if base_indent_chars and block_lines:
+            text = "".join(block_lines)
+            # Each '\n' ends a line, so this counts the lines after the first that start with the base indent
+            if text.startswith(base_indent_chars) and text.count('\n' + base_indent_chars) == len(block_lines) - 1:
+                return text[len(base_indent_chars):].replace('\n' + base_indent_chars, '\n')
+        return "".join(self._dedent_block(block_lines, base_indent_level))
+
     def _dedent_block(self, block_lines: List[str], base_indent_level: int) -> List[str]:
         """Dedents a block of lines relative to a base indent level. Returns lines WITH original line endings."""
         if not block_lines: return []
@@ -726,9 +866,10 @@ class AlthtmlCompiler:
         inferred = False
         if not base_indent_chars and base_indent_level > 0:
              # Find first non-empty, non-comment line to infer from
-             first_real_line = next((line for line in block_lines if line.strip() and not line.strip().startswith('#//')), None)
-             if first_real_line:
-                 match = re.match(r"^\s*", first_real_line)
+             first_real_line_index = _blank_flags(block_lines).find(0)
+             if first_real_line_index != -1:
+                 first_real_line = block_lines[first_real_line_index]
+                 match = _RE_LEADING_WS.match(first_real_line)
                  leading_whitespace = match.group(0) if match else ""
                  if leading_whitespace:
                     # This assumes the first line *is* at the base_indent_level
@@ -775,37 +916,38 @@ class AlthtmlCompiler:
         self.variables = {}
         self.macros = {}
 
-    def compile(self, source: str) -> str:
-        """Compiles althtml source code to HTML."""
-        # Reset state for fresh compilation
-        self.html_output = ''
-        self.tag_stack = []
+    def _reset_parse_state(self) -> None:
+        """Resets the per-source parse state (output, open tags, indentation, line number)."""
+        self._chunks = []
+        self._stack_names = []
+        self._stack_levels = []
+        self._stack_self_closing = []
         self.current_indent_level = 0
         self.line_number = 0
         self.indent_size = 0 # Reset indent detection
         self.indent_type = ''
+        self._indent_prefix = ['']
 
-
+    def _parse(self, source: str) -> str:
+        """Runs the main parse loop over source and returns the generated HTML."""
         lines = source.splitlines(keepends=True) # Keep line endings for raw blocks
+        # Prepass: flag empty and comment-only lines once, shared with the block scanners
+        self._line_blank = blank = _blank_flags(lines)
         i = 0
         while i < len(lines):
             self.line_number = i + 1 # Update line number for accurate errors
-            line = lines[i]
-            # Use rstrip to remove trailing whitespace but keep leading for indent calc
-            original_line_content_for_indent = line.rstrip('\r\n')
-            original_line_trimmed = line.strip() # Trimmed version for comment/empty check
 
             # Skip comment-only lines at the top level FIRST
-            if original_line_trimmed.startswith('#//') or not original_line_trimmed:
+            if blank[i]:
                 i += 1
                 continue
 
             # Calculate indent level using the original line (with leading ws)
-            indent_level = self._get_indent_level(original_line_content_for_indent)
+            indent_level = self._get_indent_level(lines[i])
 
             # Process the *content* part of the line (already trimmed)
             # Pass the trimmed content to _process_line
-            consumed_lines = self._process_line(original_line_trimmed, indent_level, lines, i)
+            consumed_lines = self._process_line(lines[i].strip(), indent_level, lines, i)
             i += consumed_lines
 
         # Close any remaining open tags AFTER the loop finishes
@@ -815,8 +957,18 @@ class AlthtmlCompiler:
         # if not self.html_output.strip().startswith('<html'):
         #      print("Warning: Output does not start with an <html> tag.")
 
+        html_output = "".join(self._chunks)
         # Remove trailing newline from final output if present
-        if self.html_output.endswith('\n'):
-             self.html_output = self.html_output[:-1]
+        if html_output.endswith('\n'):
+             html_output = html_output[:-1]
+        return html_output
 
-        return self.html_output
+    def compile(self, source: str) -> str:
+        """Compiles althtml source code to HTML."""
+        # Reset state for fresh compilation
+        self._reset_parse_state()
+        # Expansions may have read rawf files, which can change between compiles
+        self._macro_cache.clear()
+        html_output = self._parse(source)
+        self._chunks = [html_output] if html_output else []
+        return html_output
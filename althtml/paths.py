@@ -0,0 +1,155 @@
+import os
+import sys
+import re
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import translate
+from functools import lru_cache
+from pathlib import Path
+
+MAX_GLOB_WORKERS = 8 # Keep concurrent directory walks modest, e.g. on network mounts
+_glob_cache = {} # { pattern: (dir_mtime_ns, frozenset(paths)) }
+_path_cache = {} # { path_str: Path }
+
+def cached_path(path) -> Path:
+    """Returns a shared Path for each distinct path string, built from the interned string."""
+    key = sys.intern(str(path))
+    cached = _path_cache.get(key)
+    if cached is None:
+        cached = _path_cache[key] = Path(key)
+    return cached
+
+def _is_dir_magic_free(pattern: str) -> bool:
+    """True if wildcards only appear in the last segment of the pattern."""
+    return '**' not in pattern and not _has_magic(os.path.dirname(pattern))
+
+def _has_magic(segment: str) -> bool:
+    return any(c in segment for c in '*?[')
+
+@lru_cache(maxsize=None)
+def compile_pattern(pattern: str) -> tuple:
+    """
+    Splits a glob pattern into (segment, matcher) pairs, compiled once per pattern.
+    matcher is the compiled fnmatch regex for wildcard segments and None for
+    literal and '**' segments.
+    """
+    return tuple((seg, re.compile(translate(seg)).match if seg != '**' and _has_magic(seg) else None)
+                 for seg in pattern.split('/') if seg and seg != '.')
+
+def _walk_dirs(top: str):
+    """Yields top and every directory below it, without following symlinks."""
+    for dirpath, _, _ in os.walk(top, followlinks=False):
+        yield dirpath
+
+def walk_glob(base_path: Path, prefix: str, name_pattern: str, dir_only: bool = False) -> set:
+    """
+    Matches 'prefix/**/name_pattern' with a single os.walk over prefix.
+    The split dirnames/filenames from os.walk come from DirEntry.is_dir(),
+    so no extra stat is needed per entry.
+    """
+    _, matcher = compile_pattern(name_pattern)[0]
+    match = matcher or name_pattern.__eq__
+    matched = []
+    for dirpath, dirnames, filenames in os.walk(os.path.join(str(base_path), prefix), followlinks=False):
+        names = dirnames if dir_only else dirnames + filenames
+        matched.extend(os.path.join(dirpath, name) for name in names if match(name))
+    return {cached_path(p) for p in matched}
+
+def fast_glob(base_path: Path, pattern: str) -> set:
+    """
+    Equivalent of base_path.glob(pattern) built on os.scandir and fnmatch.
+    Matching is done on plain strings; only the final matches are wrapped in Path.
+    Supports literal segments, wildcard segments and '**' (any depth of directories).
+    """
+    if os.path.isabs(pattern):
+        raise NotImplementedError("Non-relative patterns are unsupported")
+    compiled = compile_pattern(pattern)
+    segments = [seg for seg, _ in compiled]
+    if not segments:
+        return set()
+    trailing_slash = pattern.endswith('/')
+    if len(segments) > 1 and segments[-2] == '**' and segments.count('**') == 1 \
+            and not _has_magic('/'.join(segments[:-2])) and segments[-1] != '**':
+        # Common 'prefix/**/name' shape: one os.walk instead of a per-level scan
+        return walk_glob(base_path, '/'.join(segments[:-2]), segments[-1], dir_only=trailing_slash)
+    root = str(base_path)
+    candidates = [root]
+    last = len(segments) - 1
+    for n, (segment, matcher) in enumerate(compiled):
+        dir_only = n < last or trailing_slash # Intermediate segments must match directories
+        matched = []
+        if segment == '**':
+            for candidate in candidates:
+                matched.extend(_walk_dirs(candidate))
+        elif matcher is None:
+            for candidate in candidates:
+                path = os.path.join(candidate, segment)
+                if (os.path.isdir if dir_only else os.path.exists)(path):
+                    matched.append(path)
+        else:
+            for candidate in candidates:
+                try:
+                    with os.scandir(candidate) as it:
+                        for entry in it:
+                            if matcher(entry.name) and (not dir_only or entry.is_dir()):
+                                matched.append(entry.path)
+                except OSError:
+                    continue # Not a readable directory
+        candidates = matched
+        if not candidates:
+            return set()
+    return {cached_path(p) for p in set(candidates)}
+
+def _normalize_pattern(pattern: str) -> str:
+    """Drops '.' and empty segments so equivalent patterns compare equal."""
+    normalized = '/'.join(seg for seg in pattern.split('/') if seg and seg != '.')
+    return normalized + '/' if pattern.endswith('/') and normalized else normalized
+
+def _zero_depth_forms(pattern: str) -> set:
+    """Patterns obtained by letting one '**' segment match zero directories."""
+    segments = pattern.split('/')
+    return {'/'.join(segments[:i] + segments[i + 1:]) for i, seg in enumerate(segments) if seg == '**'}
+
+def unique_patterns(patterns) -> list:
+    """
+    Removes duplicate patterns and patterns subsumed by a recursive sibling, preserving order.
+    'd/**/s' subsumes 'd/s' because '**' also matches zero directories.
+    """
+    normalized = list(dict.fromkeys(_normalize_pattern(p) for p in patterns))
+    subsumed = set()
+    for pattern in normalized:
+        subsumed |= _zero_depth_forms(pattern) - {pattern}
+    return [p for p in normalized if p not in subsumed]
+
+def cached_glob(base_path: Path, pattern: str) -> frozenset:
+    """
+    Globs pattern relative to base_path.
+    Results are reused while the mtime of the pattern's directory is unchanged,
+    so repeated expansions do not re-scan a directory whose entries did not change.
+    Patterns with wildcards in directory segments are always re-globbed.
+    """
+    if not _is_dir_magic_free(pattern):
+        return frozenset(fast_glob(base_path, pattern))
+    try:
+        dir_mtime = os.stat(base_path / os.path.dirname(pattern)).st_mtime_ns
+    except OSError:
+        return frozenset() # Directory missing, nothing can match
+    cached = _glob_cache.get(pattern)
+    if cached is not None and cached[0] == dir_mtime:
+        return cached[1]
+    paths = frozenset(fast_glob(base_path, pattern))
+    _glob_cache[pattern] = (dir_mtime, paths)
+    return paths
+
+def glob_all(base_path: Path, patterns) -> set:
+    """
+    Expands several patterns into one set of paths.
+    Directory walks are I/O bound and release the GIL, so distinct patterns are globbed in parallel.
+    """
+    patterns = unique_patterns(patterns)
+    if len(patterns) <= 1:
+        results = [cached_glob(base_path, pattern) for pattern in patterns]
+    else:
+        with ThreadPoolExecutor(max_workers=min(MAX_GLOB_WORKERS, len(patterns))) as executor:
+            results = list(executor.map(lambda pattern: cached_glob(base_path, pattern), patterns))
+    # set.union presizes the table from each frozenset's length instead of growing element by element
+    return set().union(*results)
@@ -1,41 +1,242 @@
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+import hashlib
 import logging
+import os
+import stat
+import tempfile
+import threading
 from pathlib import Path
 from .compiler import AlthtmlCompiler
+from .paths import cached_path
 
-def trigger_recompile(write_pairs, header_files, compiler):
-    for h in header_files:
-        compiler.compile(open(h, "r").read())
-    for (k, v) in write_pairs.items():
-        with open(v, "w+") as f:
-            f.write(compiler.compile(open(k, "r").read()))
+DEBOUNCE_DELAY = 0.05 # Seconds to wait for more events before recompiling, editors fire several per save
+
+def read_source(path, cache):
+    """
+    Returns (text, changed) for path.
+    cache maps path -> ((mtime_ns, size), digest, text); an unchanged mtime and size skip the read,
+    and a changed mtime with identical content (e.g. a touch or a re-save) is not reported as a change.
+    """
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[2], False
+    data = Path(path).read_bytes()
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    # Universal newlines, as reading in text mode does
+    text = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    cache[path] = (stamp, digest, text)
+    return text, cached is None or cached[1] != digest
+
+def _current_umask():
+    """os.umask() can only be read by setting it, so it is put back immediately."""
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+NEW_FILE_MODE = 0o666 & ~_current_umask() # Permissions open() would give a new output file
+
+def write_atomic(path, text):
+    """
+    Writes text to a temporary file next to path and renames it into place, so readers never see
+    a partially written file. A symlinked path is followed, so the link's target is replaced and the link kept,
+    and the existing file's permissions carry over to the new one.
+    """
+    real_path = os.path.realpath(path)
+    directory, name = os.path.split(real_path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix='.tmp')
+    try:
+        with open(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        try:
+            mode = stat.S_IMODE(os.stat(real_path).st_mode)
+        except FileNotFoundError:
+            mode = NEW_FILE_MODE # mkstemp creates the file readable by its owner only
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, real_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def trigger_recompile(write_pairs, header_files, compiler, cache=None, written=None, definitions=None, modified=None):
+    """
+    Recompiles the headers and sources from the first changed one on and writes the outputs.
+    Sources are compiled in order, each seeing the definitions of the headers and of the sources before it.
+    definitions ([(variables, macros)]) keeps the compiler's definitions after each source compiled since
+    the last header change, so a rebuild can start at the first changed source; a pass stopped by an error
+    keeps the sources compiled so far, and the next call resumes after them.
+    cache ({path: ((mtime_ns, size), digest, text)}) lets unchanged files be skipped across calls;
+    a changed header recompiles every source, since its definitions are shared.
+    written ({dst: output}) skips writing outputs identical to the last ones written,
+    so the destination is not touched and other watchers are not woken up.
+    modified (a set of header/source paths) limits the checks to the files known to have changed,
+    plus any not read or written yet; None recompiles everything, e.g. after a change to a file
+    included with rawf.
+    """
+    cache = {} if cache is None else cache
+    written = {} if written is None else written
+    definitions = [] if definitions is None else definitions
+    pairs = list(write_pairs.items())
+    start = 0 if modified is None else min(len(definitions), len(pairs))
+    for h in header_files if start else ():
+        if h in modified or h not in cache:
+            try:
+                if read_source(h, cache)[1]:
+                    start = 0
+                    break
+            except Exception:
+                cache.pop(h, None) # Retry it on the next call
+                raise
+    for i, (k, v) in enumerate(pairs[:start]):
+        if k in modified or k not in cache or v not in written:
+            try:
+                if read_source(k, cache)[1] or v not in written:
+                    start = i
+                    break
+            except Exception:
+                cache.pop(k, None)
+                raise
+    del definitions[start:]
+    if start:
+        # Pick up the definitions left by the unchanged sources before the first changed one
+        compiler.variables, compiler.macros = (d.copy() for d in definitions[-1])
+    else:
+        compiler.clear_macro_variables()
+        for h in header_files:
+            try:
+                compiler.compile(read_source(h, cache)[0])
+            except Exception:
+                cache.pop(h, None) # Not compiled, so retry it on the next call
+                raise
+    for (k, v) in pairs[start:]:
+        try:
+            output = compiler.compile(read_source(k, cache)[0])
+        except Exception:
+            cache.pop(k, None)
+            raise
+        if written.get(v) != output:
+            write_atomic(v, output)
+            written[v] = output
+        definitions.append((compiler.variables.copy(), compiler.macros.copy()))
 
 class ChangeHandler(FileSystemEventHandler):
     def __init__(self, files_to_watch, write_pairs = None, header_files = None):
         self.files_to_watch = [x.resolve() for x in files_to_watch] # Set of absolute paths (headers + sources)
+        # {normalized path string, as given or resolved: absolute path}, so events usually match without resolve()
+        self._watch_keys = {}
+        for given, resolved in zip(files_to_watch, self.files_to_watch):
+            self._watch_keys[os.path.normpath(str(given))] = resolved
+            self._watch_keys[str(resolved)] = resolved
+        self._watch_names = {os.path.basename(key) for key in self._watch_keys} # An event for any other name cannot match
+        self._watch_resolved = set(self.files_to_watch)
+        self._inputs = {x.resolve(): x for x in (*(write_pairs or ()), *(header_files or ()))} # {abs_path: path as given}
         self.write_pairs = write_pairs       # Dict {abs_src: abs_dst}
         self.header_files = header_files     # Set of absolute paths (headers)
         self.compiler = AlthtmlCompiler()
+        self._sources = {} # {path: ((mtime_ns, size), digest, text)} of the files read so far
+        self._written = {} # {dst: output} last output written to each destination
+        self._definitions = [] # [(variables, macros)] after each source, see trigger_recompile
+        self._dirty = set() # Paths modified since the last recompile
+        self._pending = None # threading.Timer that will run _flush, restarted by every event
+        self._lock = threading.Lock() # Guards _dirty and _pending
+        self._compile_lock = threading.Lock() # Keeps one recompile running at a time, the compiler is not thread-safe
         print("Handler initialized. Monitoring for changes...")
 
     def on_modified(self, event):
         if event.is_directory:
             return
 
-        # Resolve path and check if it's one we care about
-        src_path_abs = Path(event.src_path).resolve()
-        if src_path_abs in self.files_to_watch:
-            print(f"\nDetected modification in: {src_path_abs}")
-            # Pass the necessary path collections to the trigger function
-            trigger_recompile(self.write_pairs, self.header_files, self.compiler)
+        # Match the event path as a string first; resolve() costs syscalls and is only
+        # needed for paths that reach a watched file some other way (e.g. through a symlinked directory)
+        src_path = os.path.normpath(event.src_path)
+        src_path_abs = self._watch_keys.get(src_path)
+        if src_path_abs is None and os.path.basename(src_path) in self._watch_names:
+            src_path_abs = Path(src_path).resolve()
+        if src_path_abs in self._watch_resolved:
+            # Coalesce the burst of events a single save produces into one recompile
+            with self._lock:
+                self._dirty.add(src_path_abs)
+                if self._pending is not None:
+                    self._pending.cancel()
+                self._pending = threading.Timer(DEBOUNCE_DELAY, self._flush)
+                self._pending.daemon = True
+                self._pending.start()
         # else: file modified is not in our watch list, ignore.
 
+    def _flush(self):
+        """Recompiles once for all modifications collected during the debounce window."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            self._pending = None
+        if not dirty:
+            return
+        with self._compile_lock:
+            for path in sorted(dirty):
+                print(f"\nDetected modification in: {path}")
+            # Only the modified inputs and the sources after them (all sources if a header changed) are recompiled;
+            # a watch-only file (e.g. one included with rawf) may affect any output, so it rebuilds everything
+            if dirty.issubset(self._inputs):
+                modified = {self._inputs[path] for path in dirty}
+            else:
+                modified = None
+            try:
+                # Pass the necessary path collections to the trigger function
+                trigger_recompile(self.write_pairs, self.header_files, self.compiler,
+                                  self._sources, self._written, self._definitions, modified)
+            except Exception as e:
+                # Runs on the timer thread, report and keep watching; the failed file is retried on its next change
+                print(f"Error: {e}")
+
     # on_created, on_deleted can be added similarly if needed
 
 
+class FileChangedHandler(FileSystemEventHandler):
+    """Calls callback whenever a single file is written, created or moved into place."""
+    def __init__(self, path, callback):
+        self.path = Path(path).resolve()
+        self.callback = callback
+        # Normalized spellings of the path, so most events match without resolve()
+        self._keys = {os.path.normpath(os.path.abspath(path)), str(self.path)}
+        self._names = {os.path.basename(key) for key in self._keys}
+
+    def _matches(self, changed):
+        changed = os.path.normpath(changed)
+        if changed in self._keys:
+            return True
+        # resolve() only for a matching name reached some other way (e.g. through a symlinked directory)
+        return os.path.basename(changed) in self._names and Path(changed).resolve() == self.path
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in ('modified', 'created', 'moved'):
+            return
+        # Editors often save by writing a temp file and renaming it over the original
+        for changed in (event.src_path, getattr(event, 'dest_path', '')):
+            if changed and self._matches(changed):
+                self.callback()
+                return
+
+
+def watch_file(path, callback):
+    """Starts a background observer calling callback when path changes. Returns the observer."""
+    observer = Observer()
+    observer.daemon = True
+    observer.schedule(FileChangedHandler(path, callback), str(Path(path).resolve().parent), recursive=False)
+    observer.start()
+    return observer
+
+
 def run_watcher(no_write_paths, write_pairs, watch_paths):
-    """Sets up and runs the watchdog observer."""
+    """
+    Sets up and runs the watchdog observer.
+    write_pairs is a {src: dst} mapping or an iterable of (src, dst) pairs of paths or strings.
+    """
+    pairs = write_pairs.items() if hasattr(write_pairs, 'items') else write_pairs
+    write_pairs = {cached_path(src): cached_path(dst) for src, dst in pairs}
     files_to_watch = set(write_pairs.keys())
     dirs_to_watch = {p.parent for p in files_to_watch | no_write_paths | watch_paths}
     
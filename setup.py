@@ -1,4 +1,33 @@
-from setuptools import setup, find_packages
+from setuptools import setup
+from setuptools.command.build_ext import build_ext
+
+try:
+    # Cython comes from the build requirements in pyproject.toml (or the environment with --no-build-isolation)
+    from Cython.Build import cythonize
+    # Compile the pure-Python compiler module as-is; the .py stays the fallback
+    ext_modules = cythonize(["althtml/compiler.py"], language_level=3, quiet=True)
+except ImportError:
+    ext_modules = []
+
+try:
+    with open("README.md", encoding="utf-8") as f:
+        long_description = f.read()
+except FileNotFoundError:
+    long_description = "" # e.g. building from an sdist without the README
+
+class optional_build_ext(build_ext):
+    """Builds the compiled compiler module when a C toolchain is available, otherwise skips it."""
+    def run(self):
+        try:
+            super().run()
+        except Exception as e:
+            print(f"Warning: Skipping compiled extensions, using pure Python ({e}).")
+
+    def build_extension(self, ext):
+        try:
+            super().build_extension(ext)
+        except Exception as e:
+            print(f"Warning: Failed to build {ext.name}, using pure Python ({e}).")
 
 setup(
     name="althtml",
@@ -6,13 +35,18 @@ setup(
     author="Varun Bhatnagar",
     author_email="bhatnagarvarun2020@gmail.com",
     description="Python-esque markup language that compiles to html",
-    long_description=open("README.md").read(),
+    long_description=long_description,
     long_description_content_type="text/markdown",
-    packages=['althtml'],  # This will find all packages automatically
+    packages=['althtml'],
+    ext_modules=ext_modules,
+    cmdclass={'build_ext': optional_build_ext},
     python_requires=">=3.6",
     install_requires=[
         "watchdog",
         "pyyaml"
         # Add your dependencies here, e.g., "requests>=2.25.1"
     ],
-)
\ No newline at end of file
+    extras_require={
+        "json": ["orjson"], # Faster parsing of .json configs
+    },
+)
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+from althtml.compiler import AlthtmlCompiler
+
+
+class VariableTests(unittest.TestCase):
+    def test_value_refers_to_shorter_variable(self):
+        compiler = AlthtmlCompiler()
+        source = 'set name = "World"\nset greeting = "Hello name"\np | greeting'
+        self.assertEqual(compiler.compile(source), '<p>\n  Hello World\n</p>')
+
+    def test_assigning_variables_replaces_the_old_ones(self):
+        compiler = AlthtmlCompiler()
+        compiler.compile('set a = "1"\np | a')
+        compiler.variables = {'b': '2'}
+        self.assertEqual(compiler.compile('p | a b'), '<p>\n  a 2\n</p>')
+
+    def test_variable_added_to_dict_is_substituted(self):
+        compiler = AlthtmlCompiler()
+        compiler.compile('set a = "1"\np | a')
+        compiler.variables['c'] = '3'
+        self.assertEqual(compiler.compile('p | a c'), '<p>\n  1 3\n</p>')
+
+
+class MacroCacheTests(unittest.TestCase):
+    def test_rawf_in_macro_is_reread_by_each_compile(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data = os.path.join(tmp, 'data.txt')
+            with open(data, 'w') as f:
+                f.write('v1')
+            compiler = AlthtmlCompiler()
+            compiler.compile(f':macro inc\n    rawf {data}')
+            self.assertEqual(compiler.compile('@inc'), 'v1')
+            with open(data, 'w') as f:
+                f.write('v2')
+            self.assertEqual(compiler.compile('@inc'), 'v2')
+
+
+if __name__ == '__main__':
+    unittest.main()
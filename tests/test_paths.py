@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from althtml import paths
+from althtml.paths import cached_glob, fast_glob, unique_patterns
+
+PATTERNS = [
+    '*', '*.alth', '*.txt', 'a.txt', 'missing.alth', 'sub/*', 'sub/*.alth', '*/*.alth', '*/', 'sub/',
+    '**', '**/', '**/*.alth', 'sub/**/*.alth', '**/d.txt', 'sub/**', '**/deep/*', '**/**/*.alth',
+    '*/deep/*.alth', 'link/*.alth', 'link/**/*.alth', '.*', '.*/*.alth', 'sub/../a.txt',
+    'sub/deep/../c.alth', '*/../*.txt', 's?b/*.txt', '[ab].*', 'sub/[!c]*', './*.txt', 'sub//c.alth',
+]
+
+
+class GlobTestCase(unittest.TestCase):
+    """A scratch tree with nested directories, dotfiles and symlinks."""
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.base = Path(self._tmp.name)
+        for name in ('a.txt', 'b.alth', '.hidden.alth', 'sub/c.alth', 'sub/d.txt', 'sub/deep/e.alth',
+                     'sub/deep/.f.alth', 'other/g.alth', '.dot/h.alth'):
+            path = self.base / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text('x')
+        (self.base / 'link').symlink_to(self.base / 'sub', target_is_directory=True)
+        (self.base / 'filelink.alth').symlink_to(self.base / 'a.txt')
+        paths._glob_cache.clear()
+
+
+class FastGlobTests(GlobTestCase):
+    def test_matches_path_glob(self):
+        for pattern in PATTERNS:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(fast_glob(self.base, pattern), set(self.base.glob(pattern)))
+
+
+class CachedGlobTests(GlobTestCase):
+    def test_added_file_invalidates(self):
+        self.assertEqual(cached_glob(self.base, 'sub/*.alth'), {self.base / 'sub/c.alth'})
+        (self.base / 'sub/new.alth').write_text('x')
+        # Make sure the directory's mtime moves on even on filesystems with coarse timestamps
+        stamp = os.stat(self.base / 'sub').st_mtime_ns + 1_000_000_000
+        os.utime(self.base / 'sub', ns=(stamp, stamp))
+        self.assertEqual(cached_glob(self.base, 'sub/*.alth'), {self.base / 'sub/c.alth', self.base / 'sub/new.alth'})
+
+    def test_matches_path_glob(self):
+        for pattern in PATTERNS:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(cached_glob(self.base, pattern), set(self.base.glob(pattern)))
+
+
+class UniquePatternsTests(unittest.TestCase):
+    def test_recursive_pattern_subsumes_zero_depth_form(self):
+        self.assertEqual(unique_patterns(['d/*.alth', 'd/**/*.alth', '*.txt']), ['d/**/*.alth', '*.txt'])
+
+    def test_equivalent_spellings_are_merged_in_order(self):
+        self.assertEqual(unique_patterns(['./a/*', 'b/*', 'a//*', 'b/*']), ['a/*', 'b/*'])
+
+    def test_zero_depth_form_of_another_pattern_is_kept(self):
+        self.assertEqual(unique_patterns(['a/**/b/*', 'b/*']), ['a/**/b/*', 'b/*'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from althtml.compiler import AlthtmlCompiler
+from althtml.watcher import ChangeHandler, read_source, trigger_recompile, write_atomic
+
+
+class ProjectTestCase(unittest.TestCase):
+    """A header, two sources and a file included with rawf in a temporary directory."""
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.dir = Path(self._tmp.name)
+        self.header = self.write('h.alth', 'set T = "H1"')
+        self.data = self.write('data.txt', 'D1')
+        self.a = self.write('a.althtml', f':macro nav\n    nav | T\np | T\nrawf {self.data}')
+        self.b = self.write('b.althtml', '@nav\nset T = "B"\np | T')
+        self.pairs = {self.a: self.dir / 'a.html', self.b: self.dir / 'b.html'}
+
+    def write(self, name, text):
+        path = self.dir / name
+        path.write_text(text)
+        # Each edit gets a distinct mtime, as a later save would
+        stamp = getattr(self, '_stamp', 1_000_000_000) + 1
+        self._stamp = stamp
+        os.utime(path, (stamp, stamp))
+        return path
+
+    def output(self, src):
+        return self.pairs[src].read_text()
+
+
+class TriggerRecompileTests(ProjectTestCase):
+    def setUp(self):
+        super().setUp()
+        self.compiler = AlthtmlCompiler()
+        self.cache = {}
+        self.written = {}
+        self.definitions = []
+
+    def recompile(self, modified):
+        trigger_recompile(self.pairs, [self.header], self.compiler, self.cache, self.written,
+                          self.definitions, modified)
+
+    def test_later_source_sees_earlier_definitions(self):
+        self.recompile(None)
+        self.assertEqual(self.output(self.b), '<nav>\n  H1\n</nav>\n<p>\n  B\n</p>')
+        self.write('b.althtml', '@nav\np | T again')
+        self.recompile({self.b})
+        self.assertEqual(self.output(self.b), '<nav>\n  H1\n</nav>\n<p>\n  H1 again\n</p>')
+
+    def test_source_sees_header_not_later_sources(self):
+        self.recompile(None)
+        self.write('h.alth', 'set T = "H2"')
+        self.recompile({self.header})
+        self.write('b.althtml', '@nav\nset T = "B"\np | T again')
+        self.recompile({self.b})
+        self.write('a.althtml', f':macro nav\n    nav | T\np | T\nrawf {self.data}\n')
+        self.recompile({self.a})
+        self.assertEqual(self.output(self.a), '<p>\n  H2\n</p>\nD1')
+        self.assertEqual(self.output(self.b), '<nav>\n  H2\n</nav>\n<p>\n  B again\n</p>')
+
+    def test_unknown_change_rebuilds_everything(self):
+        self.recompile(None)
+        self.write('data.txt', 'D2')
+        self.recompile(None)
+        self.assertEqual(self.output(self.a), '<p>\n  H1\n</p>\nD2')
+
+    def test_failed_source_keeps_header_change_pending(self):
+        self.recompile(None)
+        self.write('h.alth', 'set T = "H2"')
+        self.write('a.althtml', '@missing')
+        with self.assertRaises(ValueError):
+            self.recompile({self.header, self.a})
+        self.write('a.althtml', f':macro nav\n    nav | T\np | T\nrawf {self.data}')
+        self.recompile({self.a})
+        self.assertEqual(self.output(self.a), '<p>\n  H2\n</p>\nD1')
+        self.assertEqual(self.output(self.b), '<nav>\n  H2\n</nav>\n<p>\n  B\n</p>')
+
+
+class ChangeHandlerTests(ProjectTestCase):
+    def setUp(self):
+        super().setUp()
+        files = {self.header, self.data, *self.pairs}
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.handler = ChangeHandler(files, write_pairs=self.pairs, header_files={self.header})
+
+    def flush(self, *paths):
+        """Runs the debounced recompile for events on paths and returns what it printed."""
+        self.handler._dirty.update(path.resolve() for path in paths)
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            self.handler._flush()
+        return log.getvalue()
+
+    def test_header_source_and_watch_only_edits(self):
+        self.flush(self.header)
+        self.assertEqual(self.output(self.a), '<p>\n  H1\n</p>\nD1')
+        self.write('h.alth', 'set T = "H2"')
+        self.flush(self.header)
+        self.assertEqual(self.output(self.a), '<p>\n  H2\n</p>\nD1')
+        self.write('b.althtml', '@nav\nset T = "B"\np | T again')
+        self.flush(self.b)
+        self.write('a.althtml', f':macro nav\n    nav | T!\np | T!\nrawf {self.data}')
+        self.flush(self.a)
+        self.assertEqual(self.output(self.a), '<p>\n  H2!\n</p>\nD1')
+        self.assertEqual(self.output(self.b), '<nav>\n  H2!\n</nav>\n<p>\n  B again\n</p>')
+        self.write('data.txt', 'D2')
+        self.assertNotIn('Error', self.flush(self.data))
+        self.assertEqual(self.output(self.a), '<p>\n  H2!\n</p>\nD2')
+
+    def test_failed_source_keeps_header_change_pending(self):
+        self.flush(self.header)
+        self.write('h.alth', 'set T = "H2"')
+        self.write('a.althtml', '@missing')
+        self.assertIn('Error', self.flush(self.header, self.a))
+        self.write('a.althtml', f':macro nav\n    nav | T\np | T\nrawf {self.data}')
+        self.assertNotIn('Error', self.flush(self.a))
+        self.assertEqual(self.output(self.b), '<nav>\n  H2\n</nav>\n<p>\n  B\n</p>')
+
+
+class ReadSourceTests(unittest.TestCase):
+    def test_line_endings_are_normalized(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'crlf.althtml'
+            path.write_bytes(b'raw\r\n    <b>x</b>\r\np | y\r')
+            text, changed = read_source(path, {})
+        self.assertEqual(text, 'raw\n    <b>x</b>\np | y\n')
+        self.assertTrue(changed)
+
+
+class WriteAtomicTests(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.dir = Path(self._tmp.name)
+
+    def test_writes_through_symlink_and_keeps_mode(self):
+        target = self.dir / 'out.html'
+        target.write_text('old')
+        target.chmod(0o640)
+        link = self.dir / 'link.html'
+        link.symlink_to(target)
+        write_atomic(link, 'new')
+        self.assertTrue(link.is_symlink())
+        self.assertEqual(target.read_text(), 'new')
+        self.assertEqual(target.stat().st_mode & 0o777, 0o640)
+
+    def test_leaves_other_files_alone(self):
+        other = self.dir / 'out.html.tmp'
+        other.write_text('mine')
+        write_atomic(self.dir / 'out.html', 'new')
+        self.assertEqual(other.read_text(), 'mine')
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), ['out.html', 'out.html.tmp'])
+
+    def test_failed_write_leaves_no_temp_file(self):
+        target = self.dir / 'out.html'
+        with self.assertRaises(TypeError):
+            write_atomic(target, None)
+        self.assertEqual(list(self.dir.iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()